@@ -4,14 +4,23 @@
 
 import os
 import sys
+import argparse
+import asyncio
+import contextvars
 import time
+import queue
+import codecs
+import csv
+import re
 import socket
 import logging
+import threading
 import configparser
 import paramiko
 import ssl
 import urllib3
 from pathlib import Path
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from typing import List, Optional, Tuple, Dict
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -27,21 +36,137 @@ except ImportError as e:
     print(f"Ошибка: Не установлен pyVmomi. Установите: pip install pyvmomi")
     sys.exit(1)
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f'esxi_patcher_{time.strftime("%Y%m%d_%H%M%S")}.log'),
-        logging.StreamHandler()
-    ]
-)
+# Контекст логирования текущего потока (имя обрабатываемого хоста)
+_log_context = threading.local()
+# То же для корутин общего цикла проверок, где в одном потоке ожидают все хосты
+_task_log_host: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('task_log_host', default=None)
+
+
+class _HostContextFilter(logging.Filter):
+    """Добавляет в запись лога имя хоста, обрабатываемого текущим потоком или корутиной"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'host'):
+            record.host = _task_log_host.get() or getattr(_log_context, 'host', '-')
+        return True
+
+
 logger = logging.getLogger(__name__)
 
 # Уменьшаем verbosity paramiko
 logging.getLogger("paramiko").setLevel(logging.WARNING)
 logging.getLogger("paramiko.transport").setLevel(logging.WARNING)
 
+# Размер блока чтения из SSH канала
+SSH_RECV_SIZE = 65536
+
+# Алгоритмы обмена ключами, исключаемые при SSH подключении
+SSH_DISABLED_KEX = ['diffie-hellman-group16-sha512', 'diffie-hellman-group18-sha512']
+
+# Буфер чтения локального файла патча
+SFTP_READ_BUFFER = 1 << 20
+
+# Службы ESXi, необходимые для работы по SSH
+SSH_SERVICES = ('TSM', 'TSM-SSH')
+
+# Сколько ждать входа в API после того, как хост снова принимает соединения (сек.)
+API_READY_TIMEOUT = 180
+
+# Таймаут проверки и интервал опроса SSH порта при ожидании начала перезагрузки (сек.)
+REBOOT_DOWN_POLL = 2
+
+# Шаблон даты сборки в имени файла патча (например, 20240304)
+_PATCH_DATE_RE = re.compile(r'\d{8}')
+
+# Команды установки патча по расширению файла
+_INSTALL_CMD_TEMPLATES = {
+    '.zip': "esxcli software vib install -d '{path}' --no-sig-check",
+    '.vib': "esxcli software vib install -v '{path}' --no-sig-check",
+    # Для ISO используем обновление профиля без указания конкретного имени
+    '.iso': "esxcli software profile update -d '{path}'",
+}
+
+# Маркер, разделяющий вывод нескольких команд в одном SSH вызове
+OUTPUT_SEPARATOR = '---SEP---'
+
+# Результат обработки хоста, прерванной пользователем
+INTERRUPTED_MESSAGE = "Прервано пользователем"
+
+# Разделители в журнале и консольном выводе (строятся один раз)
+BANNER = '*' * 60
+SEPARATOR = '=' * 60
+DIVIDER = '-' * 80
+
+# Границы экспоненциальной задержки между проверками (сек.)
+POLL_DELAY_MIN = 0.5
+POLL_DELAY_MAX = 5.0
+
+# Кэш разобранных конфигурационных файлов: путь -> (mtime, размер, ConfigParser)
+_CONFIG_CACHE: Dict[str, Tuple[float, int, configparser.ConfigParser]] = {}
+_CONFIG_CACHE_LOCK = threading.Lock()
+
+
+def _read_config(config_file: str) -> configparser.ConfigParser:
+    """Чтение конфигурации с кэшированием по времени изменения и размеру файла"""
+    path = os.path.abspath(config_file)
+    stat = os.stat(path)
+
+    with _CONFIG_CACHE_LOCK:
+        cached = _CONFIG_CACHE.get(path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+
+        config = configparser.ConfigParser()
+        config.read(path)
+        _CONFIG_CACHE[path] = (stat.st_mtime, stat.st_size, config)
+        return config
+
+
+def _pump_channel(recv, stream: str, output_queue: queue.Queue) -> None:
+    """Блокирующее чтение потока SSH канала до EOF с передачей данных в очередь"""
+    try:
+        while True:
+            data = recv(SSH_RECV_SIZE)
+            if not data:
+                break
+            output_queue.put((stream, data))
+    except Exception as e:
+        logger.debug("Чтение %s прервано: %s", stream, e)
+    finally:
+        output_queue.put((stream, None))
+
+
+def _backoff(attempt: int, cap: int = 30) -> int:
+    """Экспоненциальная задержка между проверками: 1, 2, 4, 8, 16, 30, 30, ... сек."""
+    return min(cap, 2 ** attempt)
+
+
+async def _probe(ip: str, port: int, timeout: float = 5) -> bool:
+    """
+    Асинхронная проверка доступности TCP порта.
+    Неблокирующий connect: сокет регистрируется в селекторе цикла событий на запись,
+    результат соединения проверяется через SO_ERROR — без потоков и stream-объектов.
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    try:
+        await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+        return True
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        sock.close()
+
+
+async def _cancel_pending_tasks() -> None:
+    """Отмена всех задач цикла событий, кроме текущей, с ожиданием их завершения"""
+    current = asyncio.current_task()
+    tasks = [task for task in asyncio.all_tasks() if task is not current]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
 
 @dataclass
 class ESXiHost:
@@ -52,27 +177,127 @@ class ESXiHost:
     password: str
     ssh_port: int = 22
     api_port: int = 443
+    # Имя кластера vCenter: хосты одного кластера обрабатываются последовательно
+    cluster: Optional[str] = None
+
+
+class SSHSession:
+    """Контекстный менеджер для работы с SSH подключением к хосту из пула"""
+
+    def __init__(self, patcher: 'ESXiStandalonePatcher', host: ESXiHost):
+        self.patcher = patcher
+        self.host = host
+        self.client: Optional[paramiko.SSHClient] = None
+
+    def __enter__(self) -> Optional[paramiko.SSHClient]:
+        self.client = self.patcher.ssh_connect_pooled(self.host)
+        return self.client
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.patcher.ssh_close_pooled(self.host)
+        self.client = None
+        return False
+
+
+class HostStrategy(ABC):
+    """Шаги обработки, зависящие от типа хоста; выбирается один раз в начале обработки"""
+
+    @abstractmethod
+    def pre_reboot(self, patcher: 'ESXiStandalonePatcher', host: ESXiHost,
+                   host_obj: vim.HostSystem, ssh_client: paramiko.SSHClient) -> Tuple[bool, str]:
+        """Шаги 7-8: подготовка к установке патча"""
+
+    def post_reboot(self, patcher: 'ESXiStandalonePatcher', host: ESXiHost,
+                    host_obj: vim.HostSystem, ssh_client: Optional[paramiko.SSHClient]) -> None:
+        """Шаг 17: действия после выхода из режима обслуживания"""
+
+
+class ClusteredHostStrategy(HostStrategy):
+    """Хост в кластере: ВМ мигрирует кластер (хосты одного кластера обрабатываются по очереди)"""
+
+    def pre_reboot(self, patcher: 'ESXiStandalonePatcher', host: ESXiHost,
+                   host_obj: vim.HostSystem, ssh_client: paramiko.SSHClient) -> Tuple[bool, str]:
+        logger.info("7. Хост в кластере: перевод в режим обслуживания...")
+        if not patcher.enter_maintenance_mode(host_obj, host_name=host.name):
+            return False, "Не удалось перевести в режим обслуживания"
+
+        logger.info("8. Проверка состояния ВМ (ожидание миграции)...")
+        if not patcher.check_and_shutdown_vms(ssh_client):
+            logger.warning("Не все ВМ выключены/мигрированы, но продолжаем...")
+        return True, ""
+
+
+class StandaloneHostStrategy(HostStrategy):
+    """Standalone хост: ВМ выключаются перед установкой и запускаются после перезагрузки"""
+
+    def pre_reboot(self, patcher: 'ESXiStandalonePatcher', host: ESXiHost,
+                   host_obj: vim.HostSystem, ssh_client: paramiko.SSHClient) -> Tuple[bool, str]:
+        logger.info("7. Standalone хост: выключение всех ВМ...")
+        if not patcher.check_and_shutdown_vms(ssh_client):
+            logger.warning("Не все ВМ удалось выключить, но продолжаем работу...")
+
+        logger.info("8. Standalone хост: перевод в режим обслуживания...")
+        if not patcher.enter_maintenance_mode(host_obj, host_name=host.name):
+            return False, "Не удалось перевести в режим обслуживания"
+        return True, ""
+
+    def post_reboot(self, patcher: 'ESXiStandalonePatcher', host: ESXiHost,
+                    host_obj: vim.HostSystem, ssh_client: Optional[paramiko.SSHClient]) -> None:
+        if ssh_client:
+            logger.info("17. Запуск ВМ после перезагрузки...")
+            if not patcher.start_vms_after_reboot(ssh_client):
+                logger.warning("Не все ВМ удалось запустить")
 
 
 class ESXiStandalonePatcher:
     """Основной класс для патчинга standalone ESXi хостов"""
 
+    # Время простоя, после которого SSH подключение из пула закрывается (сек.)
+    SSH_POOL_IDLE_TIMEOUT = 600
+
     def __init__(self, config_file: str = 'config.ini'):
         """Инициализация патчера"""
         self.config_file = config_file
         self.hosts: List[ESXiHost] = []
         self.patch_file: Optional[str] = None
         self.patch_name: Optional[str] = None
+        self._install_cmd_template: Optional[str] = None
         self.timeout = 300
+        self.max_parallel = 16
+        self._ssh_pool: Dict[Tuple[str, str], Tuple[paramiko.SSHClient, float]] = {}
+        self._ssh_pool_lock = threading.Lock()
+        self._api_connections: List[vim.ServiceInstance] = []
+        self._api_lock = threading.Lock()
+        self._addr_cache: Dict[str, str] = {}
+        # Запрос остановки (Ctrl-C): новые хосты и необратимые шаги больше не начинаются
+        self._stop_event = threading.Event()
+        # Общий цикл событий для проверок портов всех хостов (запускается при первом использовании)
+        self._probe_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._probe_thread: Optional[threading.Thread] = None
+        self._probe_lock = threading.Lock()
+        self._closed = False
+        # Известное состояние режима обслуживания по имени хоста (сохраняется после перезагрузки)
+        self._maint_state: Dict[str, bool] = {}
+        # Один SSL контекст на все подключения к API (сертификаты ESXi обычно самоподписанные)
+        self._ssl_ctx = ssl.create_default_context()
+        self._ssl_ctx.check_hostname = False
+        self._ssl_ctx.verify_mode = ssl.CERT_NONE
+        self._ssl_ctx.minimum_version = ssl.TLSVersion.TLSv1_2
         self._load_config()
+        self._n_hosts = len(self.hosts)
+
+        # Файл патча не меняется во время работы — проверяем его один раз
+        self._patch_available = bool(self.patch_file) and os.path.isfile(self.patch_file)
+        self._patch_size = os.path.getsize(self.patch_file) if self._patch_available else 0
+        if self.patch_file and not self._patch_available:
+            logger.warning("Файл патча не найден локально: %s", self.patch_file)
 
     def _load_config(self) -> None:
         """Загрузка конфигурации из файла"""
         if not os.path.exists(self.config_file):
             raise FileNotFoundError(f"Конфигурационный файл не найден: {self.config_file}")
 
-        config = configparser.ConfigParser()
-        config.read(self.config_file)
+        config = _read_config(self.config_file)
 
         # Настройка таймаута из settings (если указан)
         if 'settings' in config:
@@ -80,6 +305,10 @@ class ESXiStandalonePatcher:
                 self.timeout = int(config['settings'].get('timeout', str(self.timeout)))
             except Exception:
                 logger.warning("Не удалось прочитать settings.timeout, используется значение по умолчанию")
+            try:
+                self.max_parallel = max(1, int(config['settings'].get('max_parallel', str(self.max_parallel))))
+            except Exception:
+                logger.warning("Не удалось прочитать settings.max_parallel, используется значение по умолчанию")
 
         # Загрузка хостов
         for section in config.sections():
@@ -91,54 +320,190 @@ class ESXiStandalonePatcher:
                         username=config[section].get('username', 'root'),
                         password=config[section]['password'],
                         ssh_port=int(config[section].get('ssh_port', '22')),
-                        api_port=int(config[section].get('api_port', '443'))
+                        api_port=int(config[section].get('api_port', '443')),
+                        cluster=config[section].get('cluster', '').strip() or None
                     )
                 except KeyError as e:
                     raise ValueError(f"Ошибка в конфиге: секция {section} не содержит обязательного поля {e}")
+                self._validate_host(section, host)
                 self.hosts.append(host)
-                logger.info(f"Загружен хост: {host.name} ({host.ip})")
+                logger.info("Загружен хост: %s (%s)", host.name, host.ip)
 
         # Параметры патча
         if 'patch' in config:
             self.patch_file = config['patch'].get('patch_file', '').strip()
             if self.patch_file:
                 self.patch_name = os.path.basename(self.patch_file)
-                if not os.path.exists(self.patch_file):
-                    logger.warning(f"Файл патча не найден локально: {self.patch_file}")
+
+                # Тип патча определяем по расширению сразу, до подключения к хостам
+                suffix = os.path.splitext(self.patch_name)[1].lower()
+                if suffix not in _INSTALL_CMD_TEMPLATES:
+                    raise ValueError(f"Неизвестный тип патча: {self.patch_name}")
+                self._install_cmd_template = _INSTALL_CMD_TEMPLATES[suffix]
 
         if not self.hosts:
             raise ValueError("Не найдены хосты в конфигурации")
 
-    def _connect_api(self, host: ESXiHost) -> Optional[vim.ServiceInstance]:
+    @staticmethod
+    def _validate_host(section: str, host: ESXiHost) -> None:
+        """Быстрая проверка параметров хоста без подключения к нему"""
+        if not host.ip.strip():
+            raise ValueError(f"Ошибка в конфиге: секция {section} содержит пустой ip")
+        if not host.username.strip() or not host.password:
+            raise ValueError(f"Ошибка в конфиге: секция {section} содержит пустые учетные данные")
+        for field_name, port in (('ssh_port', host.ssh_port), ('api_port', host.api_port)):
+            if not 0 < port < 65536:
+                raise ValueError(f"Ошибка в конфиге: секция {section}, недопустимый {field_name}: {port}")
+
+    def _connect_api(self, host: ESXiHost, log_errors: bool = True) -> Optional[vim.ServiceInstance]:
         """Подключение к API ESXi хоста"""
         try:
-            context = ssl._create_unverified_context()
-
             si = SmartConnect(
                 host=host.ip,
                 user=host.username,
                 pwd=host.password,
                 port=host.api_port,
-                sslContext=context
+                sslContext=self._ssl_ctx
             )
 
-            logger.info(f"Успешное подключение к API хоста {host.name}")
+            with self._api_lock:
+                self._api_connections.append(si)
+
+            logger.info("Успешное подключение к API хоста %s", host.name)
             return si
 
         except Exception as e:
-            logger.error(f"Ошибка подключения к API {host.name}: {str(e)}")
+            if log_errors:
+                logger.error(f"Ошибка подключения к API {host.name}: {str(e)}")
+            else:
+                logger.debug("API %s еще не готов: %s", host.name, e)
             return None
 
+    def _wait_for_api_ready(self, host: ESXiHost, deadline: float) -> Optional[vim.ServiceInstance]:
+        """Ожидание готовности API: повторяем подключение, пока оно не удастся или не истечёт срок"""
+        while time.time() < deadline:
+            if self._stop_event.is_set():
+                return None
+            api_connection = self._connect_api(host, log_errors=False)
+            if api_connection:
+                return api_connection
+            time.sleep(min(2, max(0.0, deadline - time.time())))
+
+        # Последняя попытка — с записью причины ошибки в лог
+        return self._connect_api(host)
+
+    def _disconnect_api(self, si: vim.ServiceInstance) -> None:
+        """Отключение от API хоста (повторный вызов для того же подключения ничего не делает)"""
+        # Сравниваем по идентичности: ServiceInstance разных хостов равны по moId
+        with self._api_lock:
+            remaining = [conn for conn in self._api_connections if conn is not si]
+            if len(remaining) == len(self._api_connections):
+                return
+            self._api_connections = remaining
+
+        try:
+            Disconnect(si)
+        except Exception as e:
+            logger.debug("Ошибка отключения от API: %s", e)
+
+    def close(self) -> None:
+        """Закрытие всех открытых подключений к API и SSH"""
+        with self._api_lock:
+            connections = list(self._api_connections)
+        for si in connections:
+            self._disconnect_api(si)
+
+        with self._ssh_pool_lock:
+            clients = [client for client, _ in self._ssh_pool.values()]
+            self._ssh_pool.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+        with self._probe_lock:
+            self._closed = True
+            loop, thread = self._probe_loop, self._probe_thread
+            self._probe_loop = self._probe_thread = None
+        if loop:
+            # Незавершённые проверки отменяем внутри цикла: ожидающие их потоки получат
+            # CancelledError, а не будут ждать результата остановленного цикла бесконечно
+            asyncio.run_coroutine_threadsafe(_cancel_pending_tasks(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    def _get_probe_loop(self) -> asyncio.AbstractEventLoop:
+        """Цикл событий, в одном фоновом потоке обслуживающий проверки портов всех хостов"""
+        with self._probe_lock:
+            if self._closed:
+                raise RuntimeError("Цикл проверок портов уже закрыт")
+            if self._probe_loop is None:
+                self._probe_loop = asyncio.new_event_loop()
+                self._probe_thread = threading.Thread(
+                    target=self._probe_loop.run_forever, name='esxi-probe', daemon=True
+                )
+                self._probe_thread.start()
+            return self._probe_loop
+
+    def _run_probe(self, coro):
+        """Выполнение корутины в общем цикле проверок с ожиданием результата в текущем потоке"""
+        host_name = getattr(_log_context, 'host', None)
+
+        async def in_host_context():
+            # Контекст у каждой задачи свой: сохраняем имя хоста для записей лога
+            _task_log_host.set(host_name)
+            return await coro
+
+        try:
+            loop = self._get_probe_loop()
+        except RuntimeError:
+            coro.close()
+            raise
+        return asyncio.run_coroutine_threadsafe(in_host_context(), loop).result()
+
+    def __enter__(self) -> 'ESXiStandalonePatcher':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.close()
+        return False
+
     def _get_host_system(self, si: vim.ServiceInstance) -> Optional[vim.HostSystem]:
         """Получение объекта хоста из подключения"""
         try:
             content = si.RetrieveContent()
-            container = content.viewManager.CreateContainerView(
-                content.rootFolder, [vim.HostSystem], True
+            pc = vmodl.query.PropertyCollector
+
+            # Обход: Folder.childEntity -> Datacenter.hostFolder -> Folder.childEntity -> ComputeResource.host
+            traversal = [
+                pc.TraversalSpec(
+                    name='folderTraversal', type=vim.Folder, path='childEntity', skip=False,
+                    selectSet=[pc.SelectionSpec(name='folderTraversal'),
+                               pc.SelectionSpec(name='datacenterTraversal'),
+                               pc.SelectionSpec(name='computeResourceTraversal')]
+                ),
+                pc.TraversalSpec(
+                    name='datacenterTraversal', type=vim.Datacenter, path='hostFolder', skip=False,
+                    selectSet=[pc.SelectionSpec(name='folderTraversal')]
+                ),
+                pc.TraversalSpec(
+                    name='computeResourceTraversal', type=vim.ComputeResource, path='host', skip=False
+                ),
+            ]
+
+            filter_spec = pc.FilterSpec(
+                objectSet=[pc.ObjectSpec(obj=content.rootFolder, skip=True, selectSet=traversal)],
+                propSet=[pc.PropertySpec(type=vim.HostSystem, pathSet=['name'], all=False)]
+            )
+
+            result = content.propertyCollector.RetrievePropertiesEx(
+                [filter_spec], pc.RetrieveOptions(maxObjects=1)
             )
-            host = container.view[0] if container.view else None
-            container.Destroy()
-            return host
+            if not result or not result.objects:
+                return None
+            return result.objects[0].obj
         except Exception as e:
             logger.error(f"Ошибка получения объекта хоста: {str(e)}")
             return None
@@ -149,59 +514,98 @@ class ESXiStandalonePatcher:
             parent = host_obj.parent
             if parent and hasattr(parent, 'name'):
                 if isinstance(parent, vim.ClusterComputeResource):
-                    logger.info(f"Хост находится в кластере: {parent.name}")
+                    logger.info("Хост находится в кластере: %s", parent.name)
                     return True
                 else:
-                    logger.info(f"Хост НЕ в кластере (тип родителя: {type(parent).__name__})")
+                    logger.info("Хост НЕ в кластере (тип родителя: %s)", type(parent).__name__)
                     return False
             return False
         except Exception as e:
             logger.error(f"Ошибка определения кластерности хоста: {str(e)}")
             return False
 
-    def enable_services_via_api(self, host_obj: vim.HostSystem) -> bool:
-        """Включение служб TSM и TSM-SSH через API"""
+    def _check_clustered(self, host: ESXiHost) -> Tuple[bool, bool]:
+        """
+        Проверка кластерности хоста для планирования обработки.
+        Возвращает (удалось ли подключиться, находится ли хост в кластере).
+        Подключение к API сразу закрывается: хост может долго ждать своей очереди в группе кластера.
+        """
+        _log_context.host = host.name
+        si = None
         try:
-            service_system = host_obj.configManager.serviceSystem
-            if not service_system:
-                logger.error("Не удалось получить систему служб")
-                return False
+            si = self._connect_api(host)
+            if not si:
+                return False, False
 
-            services_to_enable = ['TSM', 'TSM-SSH']
-            enabled_services = []
+            host_obj = self._get_host_system(si)
+            if not host_obj:
+                return False, False
 
-            for service_name in services_to_enable:
-                try:
-                    service = None
-                    for s in service_system.serviceInfo.service:
-                        if s.key == service_name:
-                            service = s
-                            break
-
-                    if not service:
-                        logger.warning(f"Служба {service_name} не найдена на хосте")
-                        continue
+            return True, isinstance(host_obj.parent, vim.ClusterComputeResource)
 
-                    if not service.running:
-                        try:
-                            service_system.Start(service.key)
-                            logger.info(f"Запуск службы {service_name}")
-                        except Exception as e:
-                            logger.warning(f"Не удалось запустить службу {service_name}: {e}")
+        except Exception as e:
+            logger.error(f"Ошибка определения кластера хоста {host.name}: {str(e)}")
+            return False, False
 
-                    if getattr(service, 'policy', None) != 'on':
-                        try:
-                            service_system.UpdateServicePolicy(service.key, 'on')
-                            logger.info(f"Установка политики 'on' для службы {service_name}")
-                        except Exception as e:
-                            logger.warning(f"Не удалось установить политику 'on' для {service_name}: {e}")
+        finally:
+            if si:
+                self._disconnect_api(si)
+            _log_context.host = '-'
 
-                    enabled_services.append(service_name)
+    def _set_services(self, host_obj: vim.HostSystem, running: bool, policy: str) -> List[str]:
+        """
+        Приведение служб TSM и TSM-SSH к нужному состоянию.
+        Возвращает список служб, которые удалось обработать.
+        """
+        action = "включения" if running else "отключения"
+        service_system = host_obj.configManager.serviceSystem
+        if not service_system:
+            logger.error("Не удалось получить систему служб")
+            return []
 
-                except Exception as e:
-                    logger.error(f"Ошибка включения службы {service_name}: {str(e)}")
+        # Список служб запрашиваем один раз и индексируем по ключу
+        services = {s.key: s for s in service_system.serviceInfo.service}
+        processed = []
 
-            logger.info(f"Успешно включены службы: {enabled_services}")
+        for service_name in SSH_SERVICES:
+            try:
+                service = services.get(service_name)
+                if not service:
+                    logger.warning("Служба %s не найдена на хосте", service_name)
+                    continue
+
+                if running and not service.running:
+                    try:
+                        service_system.Start(service.key)
+                        logger.info("Запуск службы %s", service_name)
+                    except Exception as e:
+                        logger.warning("Не удалось запустить службу %s: %s", service_name, e)
+                elif not running and getattr(service, 'running', False):
+                    try:
+                        service_system.Stop(service.key)
+                        logger.info("Остановка службы %s", service_name)
+                    except Exception as e:
+                        logger.warning("Не удалось остановить службу %s: %s", service_name, e)
+
+                if getattr(service, 'policy', None) != policy:
+                    try:
+                        service_system.UpdateServicePolicy(service.key, policy)
+                        logger.info("Установка политики '%s' для службы %s", policy, service_name)
+                    except Exception as e:
+                        logger.warning("Не удалось установить политику '%s' для %s: %s", policy, service_name, e)
+
+                processed.append(service_name)
+
+            except Exception as e:
+                logger.error(f"Ошибка {action} службы {service_name}: {str(e)}")
+
+        return processed
+
+    def enable_services_via_api(self, host_obj: vim.HostSystem) -> bool:
+        """Включение служб TSM и TSM-SSH через API"""
+        try:
+            enabled_services = self._set_services(host_obj, running=True, policy='on')
+            logger.info("Успешно включены службы: %s", enabled_services)
             return len(enabled_services) > 0
 
         except Exception as e:
@@ -211,46 +615,8 @@ class ESXiStandalonePatcher:
     def disable_services_via_api(self, host_obj: vim.HostSystem) -> bool:
         """Отключение служб TSM и TSM-SSH через API"""
         try:
-            service_system = host_obj.configManager.serviceSystem
-            if not service_system:
-                logger.error("Не удалось получить систему служб")
-                return False
-
-            services_to_disable = ['TSM', 'TSM-SSH']
-            disabled_services = []
-
-            for service_name in services_to_disable:
-                try:
-                    service = None
-                    for s in service_system.serviceInfo.service:
-                        if s.key == service_name:
-                            service = s
-                            break
-
-                    if not service:
-                        logger.warning(f"Служба {service_name} не найдена на хосте")
-                        continue
-
-                    if getattr(service, 'running', False):
-                        try:
-                            service_system.Stop(service.key)
-                            logger.info(f"Остановка службы {service_name}")
-                        except Exception as e:
-                            logger.warning(f"Не удалось остановить службу {service_name}: {e}")
-
-                    if getattr(service, 'policy', None) != 'off':
-                        try:
-                            service_system.UpdateServicePolicy(service.key, 'off')
-                            logger.info(f"Установка политики 'off' для службы {service_name}")
-                        except Exception as e:
-                            logger.warning(f"Не удалось установить политику 'off' для {service_name}: {e}")
-
-                    disabled_services.append(service_name)
-
-                except Exception as e:
-                    logger.error(f"Ошибка отключения службы {service_name}: {str(e)}")
-
-            logger.info(f"Успешно отключены службы: {disabled_services}")
+            disabled_services = self._set_services(host_obj, running=False, policy='off')
+            logger.info("Успешно отключены службы: %s", disabled_services)
             return len(disabled_services) > 0
 
         except Exception as e:
@@ -259,28 +625,38 @@ class ESXiStandalonePatcher:
 
     def wait_for_ssh(self, host: ESXiHost, timeout: int = 120) -> bool:
         """Ожидание доступности SSH службы"""
-        logger.info(f"Ожидание доступности SSH на {host.name}...")
+        return self._run_probe(self.wait_for_ssh_async(host, timeout))
+
+    async def wait_for_ssh_async(self, host: ESXiHost, timeout: int = 120) -> bool:
+        """Ожидание доступности SSH службы (проверка в общем цикле событий)"""
+        logger.info("Ожидание доступности SSH на %s...", host.name)
 
+        ip = await asyncio.get_running_loop().run_in_executor(None, self._resolve, host.ip)
         start_time = time.time()
+        delay = POLL_DELAY_MIN
         while time.time() - start_time < timeout:
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(5)
-                result = sock.connect_ex((host.ip, host.ssh_port))
-                sock.close()
-
-                if result == 0:
-                    logger.info(f"SSH доступен на {host.name}")
-                    return True
-
-            except Exception:
-                pass
+            # Закрытый порт отвечает сразу, открытый принимает соединение сразу
+            if await _probe(ip, host.ssh_port, 1):
+                logger.info("SSH доступен на %s", host.name)
+                return True
 
-            time.sleep(5)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, POLL_DELAY_MAX)
 
         logger.error(f"Таймаут ожидания SSH на {host.name}")
         return False
 
+    def _resolve(self, address: str) -> str:
+        """IPv4 адрес хоста; результат getaddrinfo кэшируется, чтобы не резолвить имя при каждой проверке"""
+        cached = self._addr_cache.get(address)
+        if cached is None:
+            try:
+                cached = socket.getaddrinfo(address, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+            except socket.gaierror:
+                return address
+            self._addr_cache[address] = cached
+        return cached
+
     def ssh_connect(self, host: ESXiHost) -> Optional[paramiko.SSHClient]:
         """Установка SSH подключения"""
         try:
@@ -293,63 +669,146 @@ class ESXiStandalonePatcher:
                 username=host.username,
                 password=host.password,
                 timeout=30,
-                banner_timeout=60
+                banner_timeout=60,
+                # Дорогие DH группы не нужны: ESXi поддерживает curve25519/ecdh/group14
+                disabled_algorithms={'kex': SSH_DISABLED_KEX}
             )
 
-            logger.info(f"SSH подключение установлено к {host.name}")
+            transport = client.get_transport()
+            if transport:
+                # Держим подключение открытым во время долгой установки патча
+                transport.set_keepalive(30)
+                # и не допускаем rekey посреди неё
+                transport.packetizer.REKEY_BYTES = pow(2, 40)
+                transport.packetizer.REKEY_PACKETS = pow(2, 40)
+
+            logger.info("SSH подключение установлено к %s", host.name)
             return client
 
         except Exception as e:
             logger.error(f"Ошибка SSH подключения к {host.name}: {str(e)}")
             return None
 
-    def ssh_execute_with_output(self, client: paramiko.SSHClient, command: str, timeout: int = 300) -> Tuple[
-        bool, str, str]:
-        """Выполнение команды по SSH с захватом вывода"""
-        try:
-            logger.info(f"Выполнение команды: {command}")
+    def _evict_idle_ssh(self, key: Tuple[str, str]) -> None:
+        """
+        Закрытие простаивающего или оборванного SSH подключения пула (вызывать под блокировкой).
+        Проверяется только подключение запрашивающего хоста: подключения других хостов
+        могут быть заняты долгой командой, и last_used для них не показывает простой.
+        """
+        entry = self._ssh_pool.get(key)
+        if not entry:
+            return
+
+        client, last_used = entry
+        transport = client.get_transport()
+        if time.time() - last_used > self.SSH_POOL_IDLE_TIMEOUT or not transport or not transport.is_active():
+            del self._ssh_pool[key]
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def ssh_connect_pooled(self, host: ESXiHost) -> Optional[paramiko.SSHClient]:
+        """Получение SSH подключения из пула (одно аутентифицированное подключение на хост)"""
+        key = (host.ip, host.username)
 
-            stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+        with self._ssh_pool_lock:
+            self._evict_idle_ssh(key)
+            entry = self._ssh_pool.get(key)
+            if entry:
+                client = entry[0]
+                self._ssh_pool[key] = (client, time.time())
+                return client
 
-            # Читаем вывод в реальном времени
-            stdout_output = ""
-            stderr_output = ""
+        client = self.ssh_connect(host)
+        if not client:
+            return None
 
-            # Используем неблокирующее чтение
-            import select
+        with self._ssh_pool_lock:
+            self._ssh_pool[key] = (client, time.time())
+        return client
 
-            # Пока процесс не завершил свою работу, читаем
-            while not stdout.channel.exit_status_ready():
-                # Проверяем доступные данные
-                rlist, _, _ = select.select([stdout.channel], [], [], 1)
+    def ssh_close_pooled(self, host: ESXiHost) -> None:
+        """Закрытие SSH подключения хоста и удаление его из пула"""
+        with self._ssh_pool_lock:
+            entry = self._ssh_pool.pop((host.ip, host.username), None)
 
-                if stdout.channel in rlist:
-                    if stdout.channel.recv_ready():
-                        data = stdout.channel.recv(4096).decode('utf-8', errors='ignore')
-                        stdout_output += data
-                        if data:
-                            print(data, end='', flush=True)
-                            logger.info(f"Вывод команды: {data.strip()}")
+        if entry:
+            try:
+                entry[0].close()
+            except Exception:
+                pass
 
-                # stderr обычно приходит тоже в stdout.channel выборке; но проверим stderr отдельно
-                if stderr.channel.recv_stderr_ready():
-                    err_data = stderr.channel.recv_stderr(4096).decode('utf-8', errors='ignore')
-                    stderr_output += err_data
-                    if err_data:
-                        print(f"Ошибка: {err_data}", end='', flush=True)
-                        logger.error(f"Ошибка команды: {err_data.strip()}")
+    def ssh_execute_with_output(self, client: paramiko.SSHClient, command: str,
+                                timeout: Optional[float] = 300) -> Tuple[bool, str, str]:
+        """
+        Выполнение команды по SSH с захватом вывода.
+        timeout — допустимое время без вывода (сек.); None — без ограничения, для команд,
+        которые ничего не выводят до завершения (установка патча).
+        """
+        try:
+            logger.debug("Выполнение команды: %s", command)
+
+            # Канал открываем напрямую на транспорте: без PTY и без файловых обёрток stdin/stdout/stderr
+            transport = client.get_transport()
+            if not transport or not transport.is_active():
+                raise paramiko.SSHException("SSH подключение не активно")
+            # Канал закрывается при выходе из блока, в том числе при ошибке или таймауте
+            with transport.open_session() as channel:
+                channel.exec_command(command)
+                # Читаем блокирующе: поток просыпается только при поступлении данных
+                channel.settimeout(None)
+
+                # Читаем вывод в реальном времени: по одному потоку на stdout и stderr
+                output_queue: queue.Queue = queue.Queue()
+                readers = [
+                    threading.Thread(target=_pump_channel, args=(channel.recv, 'stdout', output_queue), daemon=True),
+                    threading.Thread(target=_pump_channel, args=(channel.recv_stderr, 'stderr', output_queue), daemon=True),
+                ]
+                for reader in readers:
+                    reader.start()
+
+                decoders = {
+                    'stdout': codecs.getincrementaldecoder('utf-8')(errors='ignore'),
+                    'stderr': codecs.getincrementaldecoder('utf-8')(errors='ignore'),
+                }
+                stdout_parts: List[str] = []
+                stderr_parts: List[str] = []
+                log_chunks = logger.isEnabledFor(logging.DEBUG)
+                finished = 0
+
+                while finished < len(readers):
+                    try:
+                        stream, raw = output_queue.get(timeout=timeout)
+                    except queue.Empty:
+                        raise socket.timeout(f"нет вывода команды в течение {timeout} сек.")
+
+                    if raw is None:
+                        finished += 1
+                        data = decoders[stream].decode(b'', final=True)
+                    else:
+                        data = decoders[stream].decode(raw)
 
-            # Прочитать остатки после завершения
-            stdout_output += stdout.read().decode('utf-8', errors='ignore')
-            stderr_output += stderr.read().decode('utf-8', errors='ignore')
+                    if not data:
+                        continue
 
-            exit_code = stdout.channel.recv_exit_status()
+                    if stream == 'stdout':
+                        stdout_parts.append(data)
+                        if log_chunks:
+                            logger.debug("Вывод команды: %s", data.strip())
+                    else:
+                        stderr_parts.append(data)
+                        logger.error(f"Ошибка команды: {data.strip()}")
+
+                exit_code = channel.recv_exit_status()
+            stdout_output = "".join(stdout_parts)
+            stderr_output = "".join(stderr_parts)
 
             # Логируем полный вывод
             if stdout_output.strip():
-                logger.debug(f"Полный вывод команды '{command}':\n{stdout_output}")
+                logger.debug("Полный вывод команды '%s':\n%s", command, stdout_output)
             if stderr_output.strip():
-                logger.debug(f"Полные ошибки команды '{command}':\n{stderr_output}")
+                logger.debug("Полные ошибки команды '%s':\n%s", command, stderr_output)
 
             success = exit_code == 0
             return success, stdout_output.strip(), stderr_output.strip()
@@ -370,24 +829,33 @@ class ESXiStandalonePatcher:
 
     def find_boot_datastore(self, ssh_client: paramiko.SSHClient) -> Optional[str]:
         """Поиск загрузочного датастора"""
+        # Одна команда: CSV список файловых систем, при ошибке esxcli — список каталогов /vmfs/volumes
         success, output = self.ssh_execute(
             ssh_client,
-            "esxcli storage filesystem list | grep -E '^/vmfs/volumes/[^ ]+' | head -1 | awk '{print $1}'"
+            "esxcli --formatter=csv storage filesystem list 2>/dev/null || ls -d /vmfs/volumes/*/ 2>/dev/null"
         )
 
-        if success and output and output.startswith('/vmfs/volumes/'):
-            logger.info(f"Найден датастор: {output}")
-            return output.strip()
-
-        success, output = self.ssh_execute(
-            ssh_client,
-            "ls -d /vmfs/volumes/*/ 2>/dev/null | head -1"
-        )
+        if not success or not output:
+            logger.error("Не удалось найти датастор")
+            return None
 
-        if success and output:
-            datastore = output.strip().rstrip('/')
-            logger.info(f"Используем первый датастор: {datastore}")
-            return datastore
+        lines = output.splitlines()
+        rows = list(csv.DictReader(lines))
+        if rows and rows[0]:
+            mount_key = next((k for k in rows[0] if k and k.replace(' ', '') == 'MountPoint'), None)
+            if mount_key:
+                for row in rows:
+                    mount_point = (row.get(mount_key) or '').strip()
+                    if mount_point.startswith('/vmfs/volumes/'):
+                        logger.info("Найден датастор: %s", mount_point)
+                        return mount_point
+
+        for line in lines:
+            line = line.strip()
+            if line.startswith('/vmfs/volumes/') and ',' not in line:
+                datastore = line.rstrip('/')
+                logger.info("Используем первый датастор: %s", datastore)
+                return datastore
 
         logger.error("Не удалось найти датастор")
         return None
@@ -395,54 +863,65 @@ class ESXiStandalonePatcher:
     def copy_patch_via_scp(self, ssh_client: paramiko.SSHClient,
                            host: ESXiHost, datastore: str) -> bool:
         """Копирование патча через SCP"""
-        if not self.patch_file or not os.path.exists(self.patch_file):
+        if not self._patch_available:
             logger.error(f"Файл патча не найден: {self.patch_file}")
             return False
 
         try:
             remote_path = f"{datastore}/{self.patch_name}"
 
-            logger.info(f"Копирование {self.patch_file} -> {remote_path}")
-
-            sftp = ssh_client.open_sftp()
+            logger.info("Копирование %s -> %s", self.patch_file, remote_path)
 
-            try:
-                sftp.stat(datastore)
-                logger.info(f"Датастор доступен: {datastore}")
-            except Exception as e:
-                logger.error(f"Датастор недоступен: {datastore}. Ошибка: {e}")
-                sftp.close()
-                return False
-
-            sftp.put(self.patch_file, remote_path)
+            with ssh_client.open_sftp() as sftp:
+                try:
+                    sftp.stat(datastore)
+                    logger.info("Датастор доступен: %s", datastore)
+                except Exception as e:
+                    logger.error(f"Датастор недоступен: {datastore}. Ошибка: {e}")
+                    return False
 
-            stat = sftp.stat(remote_path)
-            local_size = os.path.getsize(self.patch_file)
+                local_size = self._patch_size
+                # putfo пишет блоками без ожидания подтверждения каждого (pipelined);
+                # confirm=True: атрибуты файла запрашиваются после копирования
+                with open(self.patch_file, 'rb', buffering=SFTP_READ_BUFFER) as local_file:
+                    stat = sftp.putfo(local_file, remote_path, file_size=local_size, confirm=True)
 
-            if stat.st_size == local_size:
-                logger.info(f"Файл успешно скопирован ({stat.st_size} байт)")
-                sftp.close()
-                return True
-            else:
-                logger.error(f"Размеры не совпадают: локальный={local_size}, удаленный={stat.st_size}")
-                sftp.close()
-                return False
+                if stat.st_size == local_size:
+                    logger.info("Файл успешно скопирован (%d байт)", stat.st_size)
+                    return True
+                else:
+                    logger.error(f"Размеры не совпадают: локальный={local_size}, удаленный={stat.st_size}")
+                    return False
 
         except Exception as e:
             logger.error(f"Ошибка копирования через SCP: {str(e)}")
             return False
 
-    def enter_maintenance_mode(self, host_obj: vim.HostSystem, timeout: int = 0) -> bool:
-        """Перевод хоста в режим обслуживания"""
+    def enter_maintenance_mode_nowait(self, host_obj: vim.HostSystem, timeout: int = 0) -> Optional[vim.Task]:
+        """
+        Запуск перевода хоста в режим обслуживания без ожидания.
+        Возвращает задачу для _wait_for_task или None, если хост уже в режиме обслуживания.
+        """
+        if host_obj.runtime.inMaintenanceMode:
+            return None
+        return host_obj.EnterMaintenanceMode(timeout, False, None)
+
+    def enter_maintenance_mode(self, host_obj: vim.HostSystem, timeout: int = 0,
+                               host_name: Optional[str] = None) -> bool:
+        """Перевод хоста в режим обслуживания; при указании host_name состояние запоминается"""
         try:
             logger.info("Перевод хоста в режим обслуживания...")
 
-            if host_obj.runtime.inMaintenanceMode:
+            task = self.enter_maintenance_mode_nowait(host_obj, timeout)
+            if task is None:
                 logger.info("Хост уже в режиме обслуживания")
+                if host_name:
+                    self._maint_state[host_name] = True
                 return True
 
-            task = host_obj.EnterMaintenanceMode(timeout, False, None)
             self._wait_for_task(task)
+            if host_name:
+                self._maint_state[host_name] = True
 
             logger.info("Хост успешно переведен в режим обслуживания")
             return True
@@ -451,98 +930,162 @@ class ESXiStandalonePatcher:
             logger.error(f"Ошибка перевода в режим обслуживания: {str(e)}")
             return False
 
+    def _get_vm_states(self, ssh_client: paramiko.SSHClient,
+                       vm_ids: Optional[List[str]] = None) -> Optional[Dict[str, str]]:
+        """
+        Получение состояния ВМ одной SSH командой.
+        Если vm_ids не указан — опрашиваются все ВМ хоста.
+        Возвращает словарь {vm_id: состояние} или None при ошибке выполнения.
+        """
+        if vm_ids is None:
+            ids_expr = "$(vim-cmd vmsvc/getallvms | tail -n +2 | awk '{print $1}')"
+        else:
+            ids_expr = " ".join(vm_ids)
+
+        command = f'for id in {ids_expr}; do echo "$id:$(vim-cmd vmsvc/power.getstate $id | tail -1)"; done'
+        success, output = self.ssh_execute(ssh_client, command)
+        if not success:
+            return None
+
+        states: Dict[str, str] = {}
+        for line in output.splitlines():
+            vm_id, sep, state = line.partition(':')
+            vm_id = vm_id.strip()
+            if sep and vm_id.isdigit():
+                states[vm_id] = state.strip()
+        return states
+
+    def _power_vms(self, ssh_client: paramiko.SSHClient, action: str,
+                   vm_ids: List[str], timeout: int = 60) -> Dict[str, bool]:
+        """Выполнение vim-cmd vmsvc/power.<action> для списка ВМ одной SSH командой"""
+        if not vm_ids:
+            return {}
+
+        command = (
+            f"for id in {' '.join(vm_ids)}; do "
+            f"if vim-cmd vmsvc/power.{action} $id >/dev/null 2>&1; "
+            f"then echo \"$id:ok\"; else echo \"$id:fail\"; fi; done"
+        )
+        _, output = self.ssh_execute(ssh_client, command, timeout=timeout)
+
+        results = {vm_id: False for vm_id in vm_ids}
+        for line in output.splitlines():
+            vm_id, sep, status = line.partition(':')
+            if sep and vm_id.strip() in results:
+                results[vm_id.strip()] = status.strip() == 'ok'
+        return results
+
+    def _shutdown_vms_remote(self, ssh_client: paramiko.SSHClient, vm_ids: List[str],
+                             graceful_timeout: int) -> Dict[str, str]:
+        """
+        Выключение ВМ одним скриптом на стороне хоста.
+        Для каждой ВМ (параллельно): power.shutdown, ожидание выключения до graceful_timeout,
+        при необходимости power.off. Возвращает {vm_id: 'graceful' | 'force' | 'failed'}.
+        """
+        # Ожидание ограничено временем на часах хоста, а не числом итераций:
+        # vim-cmd под нагрузкой выполняется секундами, и итерации растягиваются
+        script = (
+            "shutdown_vm() { "
+            "vim-cmd vmsvc/power.shutdown $1 >/dev/null 2>&1; "
+            f"end=$(($(date +%s) + {graceful_timeout})); "
+            "while [ $(date +%s) -lt $end ]; do "
+            "sleep 5; "
+            "vim-cmd vmsvc/power.getstate $1 | grep -q 'Powered off' && { echo \"$1:graceful\"; return; }; "
+            "done; "
+            "vim-cmd vmsvc/power.off $1 >/dev/null 2>&1; "
+            "sleep 5; "
+            "vim-cmd vmsvc/power.getstate $1 | grep -q 'Powered off' && echo \"$1:force\" || echo \"$1:failed\"; "
+            "}; "
+            f"for id in {' '.join(vm_ids)}; do shutdown_vm $id & done; wait"
+        )
+
+        # До первого результата скрипт молчит graceful_timeout плюс последняя проверка,
+        # power.off и повторная проверка состояния — запас покрывает медленный vim-cmd
+        _, output = self.ssh_execute(ssh_client, script, timeout=graceful_timeout + 120)
+
+        outcome: Dict[str, str] = {}
+        for line in output.splitlines():
+            vm_id, sep, result = line.partition(':')
+            if sep and vm_id.strip() in vm_ids:
+                outcome[vm_id.strip()] = result.strip()
+        return outcome
+
     def check_and_shutdown_vms(self, ssh_client: paramiko.SSHClient,
                                graceful_timeout: int = 180) -> bool:
         """
         Проверка и корректное выключение ВМ на standalone хосте.
         Логика:
-         - Получаем список ВМ
-         - Для каждой ВМ:
-            * Если выключена — пропустить
-            * Попытка graceful shutdown (vim-cmd vmsvc/power.shutdown)
-            * Ждём до graceful_timeout секунд проверяя состояние
-            * Если не выключилась — делаем power.off (force)
+         - Получаем состояние всех ВМ одной командой
+         - Выключенные ВМ пропускаем
+         - Запущенные ВМ выключаем одним скриптом на хосте (параллельно):
+            * graceful shutdown (vim-cmd vmsvc/power.shutdown)
+            * ожидание до graceful_timeout секунд
+            * если не выключилась — принудительное power.off
+         - ВМ с неизвестным состоянием выключаем принудительно
          - Возвращаем True если нет оставшихся запущенных ВМ, иначе False
         """
         try:
-            # Получаем список всех ВМ
-            success, output = self.ssh_execute(
-                ssh_client,
-                "vim-cmd vmsvc/getallvms | tail -n +2 | awk '{print $1}'"
-            )
+            states = self._get_vm_states(ssh_client)
 
-            if not success or not output.strip():
+            if not states:
                 logger.info("ВМ на хосте не найдены")
                 return True
 
-            vm_ids = [vid.strip() for vid in output.splitlines() if vid.strip()]
-            logger.info(f"Найдено ВМ: {len(vm_ids)}")
+            logger.info("Найдено ВМ: %d", len(states))
 
             failed_vms: List[str] = []
+            powered_on: List[str] = []
+            force_off: List[str] = []
 
-            for vm_id in vm_ids:
-                logger.info(f"Обработка ВМ ID: {vm_id}")
-
-                # Получаем текущее состояние
-                success, state_output = self.ssh_execute(
-                    ssh_client,
-                    f"vim-cmd vmsvc/power.getstate {vm_id}"
-                )
-
-                if not success:
-                    logger.warning(f"Не удалось получить состояние ВМ {vm_id}, пропускаем force check")
+            for vm_id, state in states.items():
+                if not state:
+                    logger.warning("Не удалось получить состояние ВМ %s, пропускаем force check", vm_id)
                     # Попытаемся всё равно force power off как крайняя мера
-                    success_force, _ = self.ssh_execute(ssh_client, f"vim-cmd vmsvc/power.off {vm_id}")
-                    if not success_force:
+                    force_off.append(vm_id)
+                elif "Powered on" not in state:
+                    logger.info("ВМ %s не запущена (состояние: %s)", vm_id, state)
+                else:
+                    powered_on.append(vm_id)
+
+            if powered_on:
+                # Graceful shutdown, ожидание и power.off выполняются на хосте одним скриптом
+                logger.info("ВМ %s: попытка graceful shutdown (vim-cmd vmsvc/power.shutdown)", powered_on)
+                outcome = self._shutdown_vms_remote(ssh_client, powered_on, graceful_timeout)
+
+                for vm_id in powered_on:
+                    result = outcome.get(vm_id, "failed")
+                    if result == "graceful":
+                        logger.info("ВМ %s: корректно завершила работу (graceful)", vm_id)
+                    elif result == "force":
+                        logger.warning("ВМ %s: graceful shutdown не сработал, выполнено принудительное power.off", vm_id)
+                        logger.info("ВМ %s: успешно выключена принудительно", vm_id)
+                    else:
+                        logger.error(f"ВМ {vm_id}: не удалось выключить ни graceful, ни принудительно")
                         failed_vms.append(vm_id)
-                    continue
 
-                if "Powered on" not in state_output:
-                    logger.info(f"ВМ {vm_id} не запущена (состояние: {state_output})")
-                    continue
+            if force_off:
+                forced = self._power_vms(ssh_client, "off", force_off)
+                forced_ok = [vm_id for vm_id, ok in forced.items() if ok]
 
-                # Попытка graceful shutdown
-                logger.info(f"ВМ {vm_id}: попытка graceful shutdown (vim-cmd vmsvc/power.shutdown {vm_id})")
-                self.ssh_execute(ssh_client, f"vim-cmd vmsvc/power.shutdown {vm_id}")
-
-                start = time.time()
-                gracefully_stopped = False
+                for vm_id, ok in forced.items():
+                    if not ok:
+                        logger.error(f"ВМ {vm_id}: Не удалось выполнить power.off")
+                        failed_vms.append(vm_id)
 
-                while time.time() - start < graceful_timeout:
+                if forced_ok:
+                    # Небольшая пауза и проверка
                     time.sleep(5)
-                    ok, st = self.ssh_execute(ssh_client, f"vim-cmd vmsvc/power.getstate {vm_id}")
-                    if ok and "Powered off" in st:
-                        logger.info(f"ВМ {vm_id}: корректно завершила работу (graceful)")
-                        gracefully_stopped = True
-                        break
-
-                if gracefully_stopped:
-                    continue
-
-                # Если graceful не сработал — пробуем остановить через guest tools (если есть) — но т.к.
-                # точный парсинг guest-tools может отличаться, сразу делаем принудительное выключение.
-                logger.warning(f"ВМ {vm_id}: graceful shutdown не сработал, выполняем принудительное power.off")
-                ok_force, _ = self.ssh_execute(ssh_client, f"vim-cmd vmsvc/power.off {vm_id}")
+                    final = self._get_vm_states(ssh_client, forced_ok) or {}
+                    for vm_id in forced_ok:
+                        st = final.get(vm_id, "")
+                        if "Powered off" not in st:
+                            logger.error(f"ВМ {vm_id}: после force-off состояние: {st}")
+                            failed_vms.append(vm_id)
+                        else:
+                            logger.info("ВМ %s: успешно выключена принудительно", vm_id)
 
-                if not ok_force:
-                    logger.error(f"ВМ {vm_id}: Не удалось выполнить power.off")
-                    failed_vms.append(vm_id)
-                    continue
-
-                # Небольшая пауза и проверка
-                time.sleep(5)
-                ok, st = self.ssh_execute(ssh_client, f"vim-cmd vmsvc/power.getstate {vm_id}")
-                if not ok or "Powered off" not in st:
-                    logger.error(f"ВМ {vm_id}: после force-off состояние: {st}")
-                    failed_vms.append(vm_id)
-                else:
-                    logger.info(f"ВМ {vm_id}: успешно выключена принудительно")
-
-            # Финальная проверка: есть ли еще powered on
             if failed_vms:
-                logger.warning(f"Не удалось выключить ВМ: {failed_vms}")
-                # Дополнительно проверим, остались ли вообще запущенные ВМ
-                ok_all, all_states = self.ssh_execute(ssh_client, "vim-cmd vmsvc/getallvms | tail -n +2 | awk '{print $1}'")
+                logger.warning("Не удалось выключить ВМ: %s", failed_vms)
                 # Возвращаем False — у нас не все ВМ выключены
                 return False
 
@@ -550,54 +1093,45 @@ class ESXiStandalonePatcher:
             return True
 
         except Exception as e:
-            logger.error(f"Ошибка при выключении ВМ: {str(e)}", exc_info=True)
+            logger.error(f"Ошибка при выключении ВМ: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
             # Продолжаем работу даже при ошибке
             return False
 
     def start_vms_after_reboot(self, ssh_client: paramiko.SSHClient) -> bool:
         """Запуск ВМ после перезагрузки хоста (только для standalone)"""
         try:
-            success, output = self.ssh_execute(
-                ssh_client,
-                "vim-cmd vmsvc/getallvms | tail -n +2 | awk '{print $1}'"
-            )
+            states = self._get_vm_states(ssh_client)
 
-            if not success or not output.strip():
+            if not states:
                 logger.info("ВМ на хосте не найдены")
                 return True
 
-            vm_ids = [vid.strip() for vid in output.splitlines() if vid.strip()]
-            logger.info(f"Найдено ВМ для возможного запуска: {len(vm_ids)}")
+            logger.info("Найдено ВМ для возможного запуска: %d", len(states))
 
+            to_start = [vm_id for vm_id, state in states.items() if "Powered off" in state]
+            if to_start:
+                logger.info("Запуск ВМ ID: %s", to_start)
+
+            started = self._power_vms(ssh_client, "on", to_start, timeout=300)
             started_vms = 0
             failed = []
 
-            for vm_id in vm_ids:
-                success, state_output = self.ssh_execute(
-                    ssh_client,
-                    f"vim-cmd vmsvc/power.getstate {vm_id}"
-                )
-
-                if success and "Powered off" in state_output:
-                    logger.info(f"Запуск ВМ ID: {vm_id}")
-                    start_cmd = f"vim-cmd vmsvc/power.on {vm_id}"
-                    success_start, _ = self.ssh_execute(ssh_client, start_cmd)
-
-                    if success_start:
-                        started_vms += 1
-                        logger.info(f"ВМ {vm_id} запущена")
-                    else:
-                        logger.warning(f"Не удалось запустить ВМ {vm_id}")
-                        failed.append(vm_id)
+            for vm_id, ok in started.items():
+                if ok:
+                    started_vms += 1
+                    logger.info("ВМ %s запущена", vm_id)
+                else:
+                    logger.warning("Не удалось запустить ВМ %s", vm_id)
+                    failed.append(vm_id)
 
             if failed:
-                logger.warning(f"Не удалось запустить следующие ВМ: {failed}")
+                logger.warning("Не удалось запустить следующие ВМ: %s", failed)
 
-            logger.info(f"Успешно запущено ВМ: {started_vms}")
+            logger.info("Успешно запущено ВМ: %d", started_vms)
             return True
 
         except Exception as e:
-            logger.error(f"Ошибка при запуске ВМ: {str(e)}", exc_info=True)
+            logger.error(f"Ошибка при запуске ВМ: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
             return False
 
     def install_patch_via_ssh(self, ssh_client: paramiko.SSHClient,
@@ -608,98 +1142,98 @@ class ESXiStandalonePatcher:
             return False
 
         patch_path = f"{datastore}/{self.patch_name}"
+        install_cmd = self._install_cmd_template.format(path=patch_path)
 
-        # Определяем тип патча по расширению файла
-        if self.patch_name.endswith('.zip'):
-            install_cmd = f"esxcli software vib install -d '{patch_path}' --no-sig-check"
-        elif self.patch_name.endswith('.vib'):
-            install_cmd = f"esxcli software vib install -v '{patch_path}' --no-sig-check"
-        elif self.patch_name.endswith('.iso'):
-            # Для ISO используем обновление профиля без указания конкретного имени
-            install_cmd = f"esxcli software profile update -d '{patch_path}'"
-        else:
-            logger.error(f"Неизвестный тип патча: {self.patch_name}")
-            return False
-
-        logger.info(f"Установка патча: {install_cmd}")
-        print(f"\n{'=' * 80}")
-        print(f"НАЧИНАЕМ УСТАНОВКУ ПАТЧА:")
-        print(f"Команда: {install_cmd}")
-        print(f"{'=' * 80}\n")
+        logger.info("НАЧИНАЕМ УСТАНОВКУ ПАТЧА: %s", install_cmd)
 
         try:
-            # Используем метод с выводом в реальном времени
-            success, stdout, stderr = self.ssh_execute_with_output(ssh_client, install_cmd, timeout=1200)
+            # esxcli ничего не выводит до окончания установки, а прерванная установка оставит
+            # хост в режиме обслуживания с выключенными ВМ — ждём завершения без ограничения
+            success, stdout, stderr = self.ssh_execute_with_output(ssh_client, install_cmd, timeout=None)
 
             if success:
-                print(f"\n{'=' * 80}")
-                print("✅ ПАТЧ УСПЕШНО УСТАНОВЛЕН!")
-                print(f"{'=' * 80}\n")
-                logger.info(f"Патч успешно установлен")
-                logger.info(f"Вывод установки: {stdout}")
+                logger.info("Патч успешно установлен")
+                logger.info("Вывод установки: %s", stdout)
                 return True
             else:
-                print(f"\n{'=' * 80}")
-                print("❌ ОШИБКА УСТАНОВКИ ПАТЧА!")
-                print(f"Ошибка: {stderr}")
-                print(f"{'=' * 80}\n")
                 logger.error(f"Ошибка установки патча: {stderr}")
                 return False
 
         except Exception as e:
-            logger.error(f"Исключение при установке патча: {str(e)}", exc_info=True)
+            logger.error(f"Исключение при установке патча: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
             return False
 
     def verify_patch_installation(self, ssh_client: paramiko.SSHClient,
-                                  patch_pattern: str = None) -> bool:
-        """Проверка установки патча"""
+                                  patch_pattern: str = None,
+                                  cleanup_path: Optional[str] = None) -> bool:
+        """
+        Проверка установки патча.
+        Если указан cleanup_path, файл удаляется той же SSH командой (последняя секция вывода).
+        """
         if not patch_pattern and self.patch_name:
-            import re
-            match = re.search(r'\d{8}', self.patch_name)
+            match = _PATCH_DATE_RE.search(self.patch_name)
             if match:
                 patch_pattern = match.group(0)
 
+        cleanup_cmd = ""
+        if cleanup_path:
+            logger.info("Удаление файла патча: %s", cleanup_path)
+            # Код возврата rm выводится последней строкой, сама команда всегда завершается успешно
+            cleanup_cmd = f"; echo '{OUTPUT_SEPARATOR}'; rm -f '{cleanup_path}' 2>&1; echo $?"
+
         if not patch_pattern:
-            success, output = self.ssh_execute(ssh_client, "uname -a")
+            success, output = self.ssh_execute(ssh_client, "uname -a" + cleanup_cmd)
+            if cleanup_path:
+                output = self._split_cleanup_result(success, output)
             if success:
-                logger.info(f"Система загружена: {output[:100]}...")
+                logger.info("Система загружена: %s...", output[:100])
                 return True
             return False
 
-        check_cmd = f"esxcli software vib list | grep -i {patch_pattern}"
+        # Одна команда: поиск патча, последние VIB и версия ESXi, разделённые маркером
+        check_cmd = (
+            f"vibs=$(esxcli software vib list); "
+            f"echo \"$vibs\" | grep -i '{patch_pattern}'; "
+            f"echo '{OUTPUT_SEPARATOR}'; "
+            f"echo \"$vibs\" | tail -20; "
+            f"echo '{OUTPUT_SEPARATOR}'; "
+            f"vmware -v"
+            f"{cleanup_cmd}"
+        )
         success, output = self.ssh_execute(ssh_client, check_cmd)
+        if cleanup_path:
+            output = self._split_cleanup_result(success, output)
+
+        sections = [part.strip() for part in output.split(OUTPUT_SEPARATOR)] if success else []
+        found, recent_vibs, version = (sections + ['', '', ''])[:3]
 
-        if success and output:
-            logger.info(f"Патч найден в системе: {output.strip()}")
+        if found:
+            logger.info("Патч найден в системе: %s", found)
             return True
         else:
-            logger.warning(f"Патч с паттерном '{patch_pattern}' не найден в списке VIB")
+            logger.warning("Патч с паттерном '%s' не найден в списке VIB", patch_pattern)
 
-            # Пробуем альтернативные методы проверки
-            success, output = self.ssh_execute(ssh_client, "esxcli software vib list | tail -20")
-            if success:
-                logger.info(f"Последние установленные VIB: {output}")
-
-            success, output = self.ssh_execute(ssh_client, "vmware -v")
-            if success:
-                logger.info(f"Версия ESXi: {output}")
+            if recent_vibs:
+                logger.info("Последние установленные VIB: %s", recent_vibs)
+            if version:
+                logger.info("Версия ESXi: %s", version)
 
             return False
 
-    def cleanup_patch_file(self, ssh_client: paramiko.SSHClient,
-                           datastore: str) -> bool:
-        """Удаление файла патча"""
-        patch_path = f"{datastore}/{self.patch_name}"
-
-        logger.info(f"Удаление файла патча: {patch_path}")
-        success, output = self.ssh_execute(ssh_client, f"rm -f '{patch_path}'")
+    @staticmethod
+    def _split_cleanup_result(success: bool, output: str) -> str:
+        """Отделение и логирование результата удаления файла; возвращает остальной вывод"""
+        if not success:
+            logger.warning("Не удалось удалить файл патча: %s", output)
+            return output
 
-        if success:
+        output, _, cleanup_output = output.rpartition(OUTPUT_SEPARATOR)
+        lines = cleanup_output.strip().splitlines()
+        if lines and lines[-1] == '0':
             logger.info("Файл патча удален")
-            return True
         else:
-            logger.warning(f"Не удалось удалить файл патча: {output}")
-            return False
+            logger.warning("Не удалось удалить файл патча: %s", " ".join(lines[:-1]) or cleanup_output.strip())
+        return output.rstrip()
 
     def reboot_host(self, host_obj: vim.HostSystem) -> bool:
         """Перезагрузка хоста"""
@@ -720,119 +1254,156 @@ class ESXiStandalonePatcher:
             return False
 
     def _wait_for_task(self, task, timeout: int = 1800):
-        """Ожидание завершения задачи ESXI"""
-        start_time = time.time()
-        while task.info.state not in [vim.TaskInfo.State.success,
-                                      vim.TaskInfo.State.error]:
-            if time.time() - start_time > timeout:
-                raise TimeoutError(f"Таймаут ожидания задачи: {timeout} сек.")
-            time.sleep(5)
+        """Ожидание завершения задачи ESXI (без опроса: через WaitForUpdatesEx)"""
+        pc = vmodl.query.PropertyCollector
+        si = vim.ServiceInstance('ServiceInstance', task._stub)
+        # Отдельный коллектор, чтобы не мешать другим фильтрам этой сессии
+        collector = si.content.propertyCollector.CreatePropertyCollector()
+
+        try:
+            filter_spec = pc.FilterSpec(
+                objectSet=[pc.ObjectSpec(obj=task, skip=False)],
+                propSet=[pc.PropertySpec(type=vim.Task, pathSet=['info.state', 'info.error'], all=False)]
+            )
+            collector.CreateFilter(filter_spec, True)
+
+            deadline = time.time() + timeout
+            version = ''
+            state = None
+            error = None
+
+            while state not in [vim.TaskInfo.State.success, vim.TaskInfo.State.error]:
+                remaining = int(deadline - time.time())
+                if remaining <= 0:
+                    raise TimeoutError(f"Таймаут ожидания задачи: {timeout} сек.")
 
-        if task.info.state == vim.TaskInfo.State.error:
-            raise Exception(f"Ошибка задачи: {task.info.error}")
+                update = collector.WaitForUpdatesEx(version, pc.WaitOptions(maxWaitSeconds=remaining))
+                if update is None:
+                    continue
+                version = update.version
+
+                for filter_set in update.filterSet:
+                    for obj_set in filter_set.objectSet:
+                        for change in obj_set.changeSet:
+                            if change.name == 'info.state':
+                                state = change.val
+                            elif change.name == 'info.error':
+                                error = change.val
+        finally:
+            try:
+                collector.Destroy()
+            except Exception:
+                pass
+
+        if state == vim.TaskInfo.State.error:
+            raise Exception(f"Ошибка задачи: {error}")
 
     def wait_for_host_reboot(self, host: ESXiHost, timeout: int = 900) -> bool:
         """Ожидание перезагрузки хоста"""
-        logger.info(f"Ожидание перезагрузки хоста {host.name}...")
+        return self._run_probe(self.wait_for_host_reboot_async(host, timeout))
 
-        start_time = time.time()
+    async def wait_for_host_reboot_async(self, host: ESXiHost, timeout: int = 900) -> bool:
+        """Ожидание перезагрузки хоста (порты SSH и API проверяются одновременно)"""
+        logger.info("Ожидание перезагрузки хоста %s...", host.name)
+
+        # Разрешение имени блокирующее — выполняем его вне общего цикла проверок
+        ip = await asyncio.get_running_loop().run_in_executor(None, self._resolve, host.ip)
         host_went_down = False
 
         # Шаг 1: Ждем когда хост станет недоступен (начало перезагрузки)
-        logger.info(f"1. Ожидание начала перезагрузки {host.name}...")
-        print(f"\n⏳ Ожидание начала перезагрузки хоста {host.name}...")
-
-        for i in range(60):  # Ждем до 5 минут (60 * 5 секунд)
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(5)
-                result = sock.connect_ex((host.ip, 22))  # Проверяем SSH порт
-                sock.close()
-
-                if result != 0:
-                    print(f"✅ Хост {host.name} начал перезагрузку (SSH недоступен)")
-                    logger.info(f"Хост {host.name} начал перезагрузку (SSH недоступен)")
-                    host_went_down = True
-                    break
-                else:
-                    if i % 6 == 0:  # Каждые 30 секунд
-                        elapsed = i * 5
-                        print(f"   Хост еще доступен, ожидаем... ({elapsed} сек.)")
-                        logger.info(f"Хост {host.name} еще доступен, ожидаем... ({elapsed} сек.)")
-            except Exception as e:
-                logger.debug(f"Ошибка проверки хоста: {str(e)}")
-                # Это нормально во время перезагрузки
+        logger.info("1. Ожидание начала перезагрузки %s...", host.name)
+
+        # Начало перезагрузки — ожидаемое событие: опрашиваем с постоянным коротким
+        # интервалом, без нарастающей задержки
+        down_start = time.monotonic()
+        deadline = down_start + 300  # Ждем до 5 минут
+        last_status_time = down_start - 30
+
+        while time.monotonic() < deadline:
+            if not await _probe(ip, host.ssh_port, timeout=REBOOT_DOWN_POLL):
+                logger.info("Хост %s начал перезагрузку (SSH недоступен)", host.name)
+                host_went_down = True
+                break
+            else:
+                if time.monotonic() - last_status_time >= 30:  # Каждые 30 секунд
+                    elapsed = int(time.monotonic() - down_start)
+                    logger.info("Хост %s еще доступен, ожидаем... (%d сек.)", host.name, elapsed)
+                    last_status_time = time.monotonic()
 
-            time.sleep(5)
+            await asyncio.sleep(REBOOT_DOWN_POLL)
 
         if not host_went_down:
-            print(f"⚠️ Хост {host.name} не стал недоступным, продолжаем...")
-            logger.warning(f"Хост {host.name} не стал недоступным, продолжаем...")
+            logger.warning("Хост %s не стал недоступным, продолжаем...", host.name)
 
         # Шаг 2: Ждем полного поднятия хоста
-        print(f"\n⏳ Ожидание загрузки хоста {host.name}...")
-        logger.info(f"2. Ожидание загрузки хоста {host.name}...")
+        logger.info("2. Ожидание загрузки хоста %s...", host.name)
 
         max_wait = 600  # Максимальное время ожидания: 10 минут
         wait_start = time.time()
         last_status_time = wait_start
+        # Новая фаза — задержка снова начинается с минимальной
+        attempt = 0
 
         while time.time() - wait_start < max_wait:
-            try:
-                # Сначала проверяем SSH
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(5)
-                result = sock.connect_ex((host.ip, 22))
-                sock.close()
-
-                if result == 0:
-                    print(f"✅ SSH на хосте {host.name} доступен")
-                    logger.info(f"SSH на хосте {host.name} доступен")
-
-                    # Затем проверяем порт API (443)
-                    time.sleep(15)  # Даем время для поднятия API
-
-                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    sock.settimeout(5)
-                    result_api = sock.connect_ex((host.ip, 443))
-                    sock.close()
-
-                    if result_api == 0:
-                        print(f"✅ API на хосте {host.name} доступен")
-                        logger.info(f"API на хосте {host.name} доступен")
-                        time.sleep(25)  # Дополнительное время для инициализации всех служб
-                        print(f"✅ Хост {host.name} успешно загрузился!")
-                        return True
-                    else:
-                        if time.time() - last_status_time > 30:
-                            print(f"   API еще недоступен, ожидаем...")
-                            last_status_time = time.time()
-                else:
-                    elapsed = int(time.time() - wait_start)
-                    if elapsed % 30 == 0:  # Сообщаем каждые 30 секунд
-                        print(f"   Хост еще не загрузился... ({elapsed} сек.)")
-                        logger.info(f"Хост {host.name} еще не загрузился... ({elapsed} сек.)")
+            ssh_up, api_up = await asyncio.gather(
+                _probe(ip, host.ssh_port),
+                _probe(ip, host.api_port)
+            )
 
-            except Exception as e:
-                logger.debug(f"Ошибка проверки: {str(e)}")
+            if ssh_up and api_up:
+                logger.info("SSH и API на хосте %s доступны, хост загрузился", host.name)
+                return True
+            elif ssh_up:
+                if time.time() - last_status_time > 30:
+                    logger.info("API на хосте %s еще недоступен, ожидаем...", host.name)
+                    last_status_time = time.time()
+            else:
+                if time.time() - last_status_time >= 30:  # Сообщаем каждые 30 секунд
+                    elapsed = int(time.time() - wait_start)
+                    logger.info("Хост %s еще не загрузился... (%d сек.)", host.name, elapsed)
+                    last_status_time = time.time()
 
-            time.sleep(5)
+            # Не спим дольше, чем осталось до таймаута
+            remaining = max_wait - (time.time() - wait_start)
+            await asyncio.sleep(max(0.0, min(_backoff(attempt), remaining)))
+            attempt += 1
 
-        print(f"\n❌ Таймаут ожидания хоста {host.name}")
         logger.error(f"Таймаут ожидания хоста {host.name}")
         return False
 
-    def exit_maintenance_mode(self, host_obj: vim.HostSystem) -> bool:
-        """Выход из режима обслуживания"""
+    def exit_maintenance_mode_nowait(self, host_obj: vim.HostSystem) -> Optional[vim.Task]:
+        """
+        Запуск вывода хоста из режима обслуживания без ожидания.
+        Возвращает задачу для _wait_for_task или None, если хост не в режиме обслуживания.
+        """
+        if not host_obj.runtime.inMaintenanceMode:
+            return None
+        return host_obj.ExitMaintenanceMode(0)
+
+    def exit_maintenance_mode(self, host_obj: vim.HostSystem, host_name: Optional[str] = None) -> bool:
+        """
+        Выход из режима обслуживания.
+        Если состояние хоста host_name уже известно, лишний запрос runtime к API не выполняется.
+        """
         try:
             logger.info("Вывод хоста из режима обслуживания...")
 
-            if not host_obj.runtime.inMaintenanceMode:
+            in_maintenance = self._maint_state.get(host_name) if host_name else None
+            if in_maintenance:
+                # Состояние известно — без лишнего запроса runtime
+                task = host_obj.ExitMaintenanceMode(0)
+            elif in_maintenance is None:
+                task = self.exit_maintenance_mode_nowait(host_obj)
+            else:
+                task = None
+
+            if task is None:
                 logger.info("Хост не в режиме обслуживания")
                 return True
 
-            task = host_obj.ExitMaintenanceMode(0)
             self._wait_for_task(task)
+            if host_name:
+                self._maint_state[host_name] = False
 
             logger.info("Хост успешно выведен из режима обслуживания")
             return True
@@ -847,14 +1418,13 @@ class ESXiStandalonePatcher:
             print(f"\n🧪 Тестирование подключения к {host.name}...")
 
             # Тест SSH
-            ssh_client = self.ssh_connect(host)
-            if ssh_client:
-                success, output = self.ssh_execute(ssh_client, "vmware -v")
-                ssh_client.close()
-                if success:
-                    print(f"✅ SSH: OK - {output}")
-                else:
-                    print(f"❌ SSH: Ошибка - {output}")
+            with SSHSession(self, host) as ssh_client:
+                if ssh_client:
+                    success, output = self.ssh_execute(ssh_client, "vmware -v")
+                    if success:
+                        print(f"✅ SSH: OK - {output}")
+                    else:
+                        print(f"❌ SSH: Ошибка - {output}")
 
             # Тест API
             api_conn = self._connect_api(host)
@@ -862,7 +1432,7 @@ class ESXiStandalonePatcher:
                 host_obj = self._get_host_system(api_conn)
                 if host_obj:
                     print(f"✅ API: OK - {host_obj.summary.config.product.fullName}")
-                Disconnect(api_conn)
+                self._disconnect_api(api_conn)
 
             return True, "Тест пройден"
 
@@ -872,19 +1442,15 @@ class ESXiStandalonePatcher:
     def process_host(self, host: ESXiHost) -> Tuple[bool, str]:
         """Полный процесс патчинга для одного хоста"""
         host_start_time = time.time()
-        print(f"\n{'=' * 80}")
-        print(f"🚀 НАЧАЛО ОБРАБОТКИ ХОСТА: {host.name} ({host.ip})")
-        print(f"{'=' * 80}")
-        logger.info(f"\n{'=' * 60}")
-        logger.info(f"НАЧАЛО ОБРАБОТКИ ХОСТА: {host.name} ({host.ip})")
-        logger.info(f"{'=' * 60}")
+        logger.info("\n%s", SEPARATOR)
+        logger.info("НАЧАЛО ОБРАБОТКИ ХОСТА: %s (%s)", host.name, host.ip)
+        logger.info("%s", SEPARATOR)
 
         api_connection = None
         ssh_client = None
 
         try:
             # ШАГ 1: Подключение к API ESXi
-            print("\n1. Подключение к API ESXi...")
             logger.info("1. Подключение к API ESXi...")
             api_connection = self._connect_api(host)
             if not api_connection:
@@ -894,137 +1460,94 @@ class ESXiStandalonePatcher:
             if not host_obj:
                 return False, "Ошибка получения объекта хоста"
 
-            # Определение, находится ли хост в кластере
-            is_clustered = self.is_host_in_cluster(host_obj)
+            # Тип хоста определяется один раз: дальше шаги выполняет выбранная стратегия
+            if self.is_host_in_cluster(host_obj):
+                strategy = ClusteredHostStrategy()
+            else:
+                strategy = StandaloneHostStrategy()
 
             # ШАГ 2: Включение служб TSM и TSM-SSH через API
-            print("2. Включение служб TSM и TSM-SSH...")
             logger.info("2. Включение служб TSM и TSM-SSH...")
             if not self.enable_services_via_api(host_obj):
-                print("⚠️ Не удалось включить службы, но продолжаем...")
                 logger.warning("Не удалось включить службы, но продолжаем...")
 
             # ШАГ 3: Ожидание доступности SSH
-            print("3. Ожидание доступности SSH...")
             logger.info("3. Ожидание доступности SSH...")
             if not self.wait_for_ssh(host, timeout=120):
-                print("⚠️ SSH не доступен, но продолжаем...")
                 logger.warning("SSH не доступен, но продолжаем...")
 
             # ШАГ 4: Подключение по SSH
-            print("4. Подключение по SSH...")
             logger.info("4. Подключение по SSH...")
-            ssh_client = self.ssh_connect(host)
+            ssh_client = self.ssh_connect_pooled(host)
             if not ssh_client:
                 return False, "Не удалось подключиться по SSH"
 
             # ШАГ 5: Определение загрузочного датастора
-            print("5. Поиск загрузочного датастора...")
             logger.info("5. Поиск загрузочного датастора...")
             datastore = self.find_boot_datastore(ssh_client)
             if not datastore:
                 return False, "Не удалось найти датастор"
 
             # ШАГ 6: Копирование патча на датастор
-            if self.patch_file and os.path.exists(self.patch_file):
-                print("6. Копирование файла патча...")
+            if self._patch_available:
                 logger.info("6. Копирование файла патча...")
                 if not self.copy_patch_via_scp(ssh_client, host, datastore):
                     return False, "Не удалось скопировать патч"
             else:
-                print("6. Пропуск копирования патча (файл не указан или не найден)")
                 logger.info("6. Пропуск копирования патча (файл не указан или не найден)")
 
-            # ШАГ 7: Обработка в зависимости от типа хоста
-            if is_clustered:
-                print("7. Хост в кластере: перевод в режим обслуживания...")
-                logger.info("7. Хост в кластере: перевод в режим обслуживания...")
-                if not self.enter_maintenance_mode(host_obj):
-                    return False, "Не удалось перевести в режим обслуживания"
-
-                print("8. Проверка состояния ВМ (ожидание миграции)...")
-                logger.info("8. Проверка состояния ВМ (ожидание миграции)...")
-                vm_result = self.check_and_shutdown_vms(ssh_client)
-                if not vm_result:
-                    print("⚠️ Не все ВМ выключены/мигрированы, но продолжаем...")
-                    logger.warning("Не все ВМ выключены/мигрированы, но продолжаем...")
-            else:
-                print("7. Standalone хост: выключение всех ВМ...")
-                logger.info("7. Standalone хост: выключение всех ВМ...")
-                vm_result = self.check_and_shutdown_vms(ssh_client)
-                if not vm_result:
-                    print("⚠️ Не все ВМ удалось выключить, но продолжаем работу...")
-                    logger.warning("Не все ВМ удалось выключить, но продолжаем работу...")
-
-                print("8. Standalone хост: перевод в режим обслуживания...")
-                logger.info("8. Standalone хост: перевод в режим обслуживания...")
-                if not self.enter_maintenance_mode(host_obj):
-                    return False, "Не удалось перевести в режим обслуживания"
+            if self._stop_requested():
+                return False, INTERRUPTED_MESSAGE
+
+            # ШАГИ 7-8: Обработка в зависимости от типа хоста
+            success, message = strategy.pre_reboot(self, host, host_obj, ssh_client)
+            if not success:
+                return False, message
+
+            if self._stop_requested():
+                return False, INTERRUPTED_MESSAGE
 
             # ШАГ 9: Установка патча
-            if self.patch_file and os.path.exists(self.patch_file):
-                print("9. Установка патча...")
+            if self._patch_available:
                 logger.info("9. Установка патча...")
                 if not self.install_patch_via_ssh(ssh_client, datastore):
                     return False, "Не удалось установить патч"
             else:
-                print("9. Пропуск установки патча")
                 logger.info("9. Пропуск установки патча")
 
-            # ШАГ 10: Проверка установки
-            print("10. Проверка установки патча...")
+            # ШАГИ 10-11: Проверка установки и удаление файла патча одной SSH командой
             logger.info("10. Проверка установки патча...")
-            if not self.verify_patch_installation(ssh_client):
-                print("⚠️ Не удалось подтвердить установку патча")
+            cleanup_path = None
+            if self._patch_available:
+                logger.info("11. Очистка файла патча...")
+                cleanup_path = f"{datastore}/{self.patch_name}"
+            if not self.verify_patch_installation(ssh_client, cleanup_path=cleanup_path):
                 logger.warning("Не удалось подтвердить установку патча")
 
-            # ШАГ 11: Удаление файла патча
-            if self.patch_file and os.path.exists(self.patch_file):
-                print("11. Очистка файла патча...")
-                logger.info("11. Очистка файла патча...")
-                self.cleanup_patch_file(ssh_client, datastore)
+            if self._stop_requested():
+                return False, INTERRUPTED_MESSAGE
 
             # ШАГ 12: Перезагрузка хоста
-            print("12. Перезагрузка хоста...")
             logger.info("12. Перезагрузка хоста...")
             if not self.reboot_host(host_obj):
                 return False, "Ошибка при перезагрузке"
 
             # Закрываем соединения перед перезагрузкой
-            if ssh_client:
-                ssh_client.close()
+            self.ssh_close_pooled(host)
+            ssh_client = None
             if api_connection:
-                Disconnect(api_connection)
+                self._disconnect_api(api_connection)
 
             # ШАГ 13: Ожидание перезагрузки
-            print("13. Ожидание перезагрузки хоста...")
             logger.info("13. Ожидание перезагрузки хоста...")
             if not self.wait_for_host_reboot(host, timeout=600):
                 return False, "Хост не перезагрузился или недоступен после перезагрузки"
 
-            # Ждем еще немного для полной инициализации
-            print("Ждем инициализации всех служб...")
-            time.sleep(30)
-
-            # ШАГ 14: Повторное подключение
-            print("14. Повторное подключение после перезагрузки...")
+            # ШАГ 14: Повторное подключение, как только API начнёт принимать вход
             logger.info("14. Повторное подключение после перезагрузки...")
-
-            # Пробуем подключиться несколько раз
-            max_retries = 5
-            api_connection = None
-
-            for attempt in range(max_retries):
-                print(f"   Попытка подключения {attempt + 1}/{max_retries}...")
-
-                api_connection = self._connect_api(host)
-                if api_connection:
-                    print("✅ Подключение к API восстановлено")
-                    break
-                else:
-                    if attempt < max_retries - 1:
-                        print(f"   Ожидание перед следующей попыткой...")
-                        time.sleep(30)
+            api_connection = self._wait_for_api_ready(host, time.time() + API_READY_TIMEOUT)
+            if api_connection:
+                logger.info("Подключение к API восстановлено")
 
             if not api_connection:
                 return False, "Не удалось подключиться после перезагрузки"
@@ -1034,142 +1557,239 @@ class ESXiStandalonePatcher:
                 return False, "Не удалось получить объект хоста после перезагрузки"
 
             # Подключаемся по SSH снова
-            print("15. Повторное подключение по SSH...")
             logger.info("15. Повторное подключение по SSH...")
-            ssh_client = self.ssh_connect(host)
+            ssh_client = self.ssh_connect_pooled(host)
             if not ssh_client:
-                print("⚠️ Не удалось подключиться по SSH после перезагрузки")
                 logger.warning("Не удалось подключиться по SSH после перезагрузки")
 
             # ШАГ 16: Выход из режима обслуживания
-            print("16. Выход из режима обслуживания...")
             logger.info("16. Выход из режима обслуживания...")
-            if not self.exit_maintenance_mode(host_obj):
-                print("⚠️ Не удалось выйти из режима обслуживания")
+            if not self.exit_maintenance_mode(host_obj, host.name):
                 logger.warning("Не удалось выйти из режима обслуживания")
 
             # ШАГ 17: Запуск ВМ (только для standalone хостов)
-            if not is_clustered and ssh_client:
-                print("17. Запуск ВМ после перезагрузки...")
-                logger.info("17. Запуск ВМ после перезагрузки...")
-                if not self.start_vms_after_reboot(ssh_client):
-                    print("⚠️ Не все ВМ удалось запустить")
-                    logger.warning("Не все ВМ удалось запустить")
+            strategy.post_reboot(self, host, host_obj, ssh_client)
 
             # ШАГ 18: Отключение служб TSM и TSM-SSH (для безопасности)
-            print("18. Отключение служб TSM и TSM-SSH...")
             logger.info("18. Отключение служб TSM и TSM-SSH...")
             if not self.disable_services_via_api(host_obj):
-                print("⚠️ Не удалось отключить службы TSM/TSM-SSH")
                 logger.warning("Не удалось отключить службы TSM/TSM-SSH")
 
             elapsed = int(time.time() - host_start_time)
-            print(f"\n{'=' * 80}")
-            print(f"✅ ХОСТ {host.name} УСПЕШНО ОБРАБОТАН за {elapsed} сек.")
-            print(f"{'=' * 80}")
-            logger.info(f"{'=' * 60}")
-            logger.info(f"ХОСТ {host.name} УСПЕШНО ОБРАБОТАН за {elapsed} сек.")
-            logger.info(f"{'=' * 60}")
+            logger.info("%s", SEPARATOR)
+            logger.info("ХОСТ %s УСПЕШНО ОБРАБОТАН за %d сек.", host.name, elapsed)
+            logger.info("%s", SEPARATOR)
 
             return True, "Успех"
 
         except Exception as e:
-            print(f"\n❌ Критическая ошибка при обработке хоста {host.name}: {str(e)}")
-            logger.error(f"Критическая ошибка при обработке хоста {host.name}: {str(e)}", exc_info=True)
+            logger.error(f"Критическая ошибка при обработке хоста {host.name}: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
             return False, f"Исключение: {str(e)}"
 
         finally:
             # Всегда закрываем соединения
-            if ssh_client:
-                try:
-                    ssh_client.close()
-                except:
-                    pass
+            self.ssh_close_pooled(host)
 
             if api_connection:
-                try:
-                    Disconnect(api_connection)
-                except:
-                    pass
-
-    def run(self) -> bool:
-        """Основной метод запуска"""
-        print(f"\n{'*' * 80}")
-        print(f"🚀 ЗАПУСК ESXi STANDALONE PATCHER")
-        print(f"Количество хостов: {len(self.hosts)}")
-        if self.patch_file:
-            print(f"Патч: {self.patch_name}")
-        print(f"{'*' * 80}\n")
+                self._disconnect_api(api_connection)
+
+    def _patch_host_worker(self, host: ESXiHost) -> Tuple[bool, str]:
+        """Обработка одного хоста в рабочем потоке пула"""
+        _log_context.host = host.name
+        try:
+            logger.info("Поток обработки хоста %s запущен", host.name)
+            return self.process_host(host)
+        finally:
+            _log_context.host = '-'
+
+    def _stop_requested(self) -> bool:
+        """Проверка запроса остановки перед необратимым шагом обработки хоста"""
+        if self._stop_event.is_set():
+            logger.warning("Обработка прервана пользователем")
+            return True
+        return False
+
+    def _patch_group_worker(self, hosts: List[ESXiHost]) -> Dict[str, Tuple[bool, str]]:
+        """Последовательная обработка группы хостов (хостов одного кластера) в одном рабочем потоке"""
+        results: Dict[str, Tuple[bool, str]] = {}
+        for host in hosts:
+            if self._stop_event.is_set():
+                results[host.name] = (False, INTERRUPTED_MESSAGE)
+                continue
+            try:
+                results[host.name] = self._patch_host_worker(host)
+            except Exception as e:
+                logger.error(f"Необработанная ошибка в потоке хоста {host.name}: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
+                results[host.name] = (False, f"Исключение: {str(e)}")
+        return results
+
+    def _group_hosts(self, max_workers: int) -> Tuple[List[List[ESXiHost]], Dict[str, Tuple[bool, str]]]:
+        """
+        Разбиение хостов на группы обработки: хосты с одинаковым cluster из конфигурации — одна группа,
+        каждый standalone хост — отдельная группа.
+        Принадлежность к кластеру vCenter по прямому подключению к хосту не определить
+        (moId уникальны только в пределах одного сервера), поэтому хосты в кластере без
+        указанного cluster обрабатываются одной общей последовательной группой.
+        Возвращает группы и результаты для хостов, к API которых не удалось подключиться.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='esxi-scan') as scanner:
+            checks = list(scanner.map(self._check_clustered, self.hosts))
+
+        groups: List[List[ESXiHost]] = []
+        clusters: Dict[str, List[ESXiHost]] = {}
+        unnamed_cluster: List[ESXiHost] = []
+        failed: Dict[str, Tuple[bool, str]] = {}
+
+        for host, (connected, clustered) in zip(self.hosts, checks):
+            if not connected:
+                failed[host.name] = (False, "Ошибка подключения к API")
+            elif host.cluster:
+                if host.cluster not in clusters:
+                    clusters[host.cluster] = []
+                    groups.append(clusters[host.cluster])
+                clusters[host.cluster].append(host)
+            elif clustered:
+                logger.warning("Хост %s в кластере, но cluster не указан в конфигурации — "
+                               "обрабатывается вместе с другими такими хостами последовательно", host.name)
+                if not unnamed_cluster:
+                    groups.append(unnamed_cluster)
+                unnamed_cluster.append(host)
+            else:
+                groups.append([host])
+
+        return groups, failed
+
+    def patch_all(self, max_workers: Optional[int] = None) -> Dict[str, Tuple[bool, str]]:
+        """
+        Параллельная обработка всех хостов.
+        Каждая группа хостов обрабатывается в отдельном потоке со своими SSH/API подключениями,
+        т.к. работа с хостом почти целиком состоит из ожидания сети и перезагрузки.
+        Хосты одного кластера обрабатываются одним потоком по очереди, standalone хосты — параллельно.
+        """
+        if max_workers is None:
+            max_workers = min(self.max_parallel, self._n_hosts)
+        max_workers = max(1, max_workers)
+
+        groups, results = self._group_hosts(max_workers)
 
-        logger.info(f"\n{'*' * 60}")
-        logger.info(f"ЗАПУСК ESXi STANDALONE PATCHER")
-        logger.info(f"Количество хостов: {len(self.hosts)}")
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='esxi')
+        try:
+            futures = {executor.submit(self._patch_group_worker, group): group for group in groups}
+
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    results.update(future.result())
+                except Exception as e:
+                    logger.error(f"Необработанная ошибка в потоке обработки: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
+                    for host in group:
+                        results.setdefault(host.name, (False, f"Исключение: {str(e)}"))
+        except KeyboardInterrupt:
+            # Ещё не начатые группы отменяем; обрабатываемые хосты не начинают необратимых шагов,
+            # а текущие ожидания прерываются закрытием подключений и цикла проверок в close().
+            # Потоки пула всё равно дожидаются при выходе из интерпретатора
+            self._stop_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True)
+
+        # Сохраняем порядок хостов из конфигурации для итогового отчёта
+        return {host.name: results[host.name] for host in self.hosts}
+
+    def run(self, pre_check: bool = False) -> bool:
+        """Основной метод запуска (pre_check — предварительный тест подключения ко всем хостам)"""
+        logger.info("\n%s", BANNER)
+        logger.info("ЗАПУСК ESXi STANDALONE PATCHER")
+        logger.info("Количество хостов: %d", self._n_hosts)
         if self.patch_file:
-            logger.info(f"Патч: {self.patch_name}")
-        logger.info(f"{'*' * 60}\n")
+            logger.info("Патч: %s", self.patch_name)
+        logger.info("%s\n", BANNER)
 
         results = {}
 
-        # Предварительное тестирование подключений
-        if len(self.hosts) > 0:
+        # Предварительное тестирование подключений (только по запросу: шаги 1 и 4
+        # обработки хоста выполняют те же подключения и сообщат об ошибке сами)
+        if pre_check:
             print("\n🧪 ПРЕДВАРИТЕЛЬНОЕ ТЕСТИРОВАНИЕ ПОДКЛЮЧЕНИЙ...")
             for host in self.hosts:
                 success, message = self.test_connection(host)
                 if not success:
-                    print(f"❌ Тест подключения к {host.name} не пройден: {message}")
                     logger.error(f"Тест подключения к {host.name} не пройден: {message}")
                 else:
                     print(f"✅ Тест подключения к {host.name} пройден")
 
-            print("\n" + "-" * 80)
-
-        for i, host in enumerate(self.hosts, 1):
-            print(f"\n>>> Обработка хоста {i}/{len(self.hosts)}: {host.name}")
-            logger.info(f"\n>>> Обработка хоста {i}/{len(self.hosts)}: {host.name}")
+            print("\n" + DIVIDER)
 
-            success, message = self.process_host(host)
-            results[host.name] = (success, message)
+        logger.info("\n>>> Параллельная обработка хостов: %d", self._n_hosts)
 
-            if i < len(self.hosts):
-                pause = 30
-                print(f"\nПауза {pause} сек. перед следующим хостом...")
-                logger.info(f"Пауза {pause} сек. перед следующим хостом...")
-                time.sleep(pause)
+        results.update(self.patch_all())
 
-        print(f"\n{'*' * 80}")
-        print("📊 РЕЗУЛЬТАТЫ ВЫПОЛНЕНИЯ:")
-        print(f"{'*' * 80}")
-        logger.info(f"\n{'*' * 60}")
+        logger.info("\n%s", BANNER)
         logger.info("РЕЗУЛЬТАТЫ ВЫПОЛНЕНИЯ:")
-        logger.info(f"{'*' * 60}")
+        logger.info("%s", BANNER)
 
         success_count = 0
         fail_count = 0
 
         for host_name, (success, message) in results.items():
-            status = "✅ УСПЕХ" if success else "❌ ОШИБКА"
-            print(f"{host_name}: {status} - {message}")
-            logger.info(f"{host_name}: {'УСПЕХ' if success else 'ОШИБКА'} - {message}")
+            logger.info("%s: %s - %s", host_name, 'УСПЕХ' if success else 'ОШИБКА', message)
 
             if success:
                 success_count += 1
             else:
                 fail_count += 1
 
-        print(f"\n📈 Итого: Успешно - {success_count}, С ошибками - {fail_count}")
-        logger.info(f"\nИтого: Успешно - {success_count}, С ошибками - {fail_count}")
+        logger.info("\nИтого: Успешно - %d, С ошибками - %d", success_count, fail_count)
 
         return fail_count == 0
 
 
+# Форматы журналов; трейсбеки ошибок пишутся только на уровне DEBUG (--debug)
+LOG_FORMAT = '%(asctime)s - %(name)s - [%(host)s] - %(levelname)s - %(message)s'
+CONSOLE_LOG_FORMAT = '%(asctime)s - [%(host)s] - %(levelname)s - %(message)s'
+
+
+def _setup_logging(debug: bool = False) -> None:
+    """Настройка логирования (файл и консоль); повторный вызов ничего не меняет"""
+    if logging.getLogger().handlers:
+        return
+
+    # Ошибки внутри обработчиков не должны выводить собственные трейсбеки в stderr
+    logging.raiseExceptions = False
+
+    # Консольный вывод: единый путь для прогресса всех хостов, с именем хоста в каждой строке
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter(CONSOLE_LOG_FORMAT))
+
+    logging.basicConfig(
+        level=logging.DEBUG if debug else logging.INFO,
+        format=LOG_FORMAT,
+        handlers=[
+            logging.FileHandler(f'esxi_patcher_{time.strftime("%Y%m%d_%H%M%S")}.log'),
+            console
+        ]
+    )
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(_HostContextFilter())
+
+
 def main():
     """Точка входа в программу"""
+    parser = argparse.ArgumentParser(description="Патчинг standalone ESXi хостов")
+    parser.add_argument('--pre-check', action='store_true',
+                        help="предварительно проверить SSH и API подключение ко всем хостам")
+    parser.add_argument('--debug', action='store_true',
+                        help="подробный журнал с трейсбеками ошибок")
+    args = parser.parse_args()
+
+    _setup_logging(debug=args.debug)
     try:
         if not os.path.exists('config.ini'):
             print("❌ Конфигурационный файл config.ini не найден!")
             print("\nСоздайте файл config.ini со следующей структурой:")
             print("\n[settings]")
             print("timeout = 300")
+            print("max_parallel = 16")
             print("\n[patch]")
             print("# patch_file = C:\\path\\to\\ESXi-patch.zip  # опционально")
             print("\n[host_esxi01]")
@@ -1179,11 +1799,14 @@ def main():
             print("password = your_password")
             print("ssh_port = 22")
             print("api_port = 443")
+            print("# cluster = Cluster-01  # для хостов в кластере vCenter")
 
             # Создаем пример конфига
             with open('config.ini', 'w') as f:
                 f.write("""[settings]
 timeout = 300
+# Максимальное число одновременно обрабатываемых хостов
+max_parallel = 16
 
 [patch]
 # Укажите путь к файлу патча (опционально)
@@ -1196,13 +1819,15 @@ username = root
 password = your_password
 ssh_port = 22
 api_port = 443
+# Имя кластера vCenter (только для хостов в кластере)
+# cluster = Cluster-01
 """)
             print("\n✅ Создан пример конфигурационного файла config.ini")
             print("Отредактируйте его и запустите скрипт снова.")
             sys.exit(1)
 
-        patcher = ESXiStandalonePatcher('config.ini')
-        success = patcher.run()
+        with ESXiStandalonePatcher('config.ini') as patcher:
+            success = patcher.run(pre_check=args.pre_check)
 
         if success:
             print("\n✅ Все хосты успешно обработаны!")
@@ -1215,7 +1840,7 @@ api_port = 443
         print("\n\n⚠️  Прервано пользователем")
         sys.exit(130)
     except Exception as e:
-        logger.error(f"Ошибка запуска: {str(e)}", exc_info=True)
+        logger.error(f"Ошибка запуска: {str(e)}", exc_info=logger.isEnabledFor(logging.DEBUG))
         print(f"\n❌ Критическая ошибка: {str(e)}")
         sys.exit(1)
 